@@ -15,7 +15,7 @@ from gbdx_auth import gbdx_auth
 
 from gbdxtools.s3 import S3
 from gbdxtools.ordering import Ordering
-from gbdxtools.workflow import Workflow
+from gbdxtools.workflow import Workflow, get_session
 from gbdxtools.catalog import Catalog
 from gbdxtools.idaho import Idaho
 import gbdxtools.simpleworkflows
@@ -32,8 +32,10 @@ class Interface(object):
             # Pass in a custom gbdx connection object, for testing purposes
             self.gbdx_connection = kwargs.get('gbdx_connection')
         else:
-            # This will throw an exception if your .ini file is not set properly
-            self.gbdx_connection = gbdx_auth.get_session(kwargs.get('config_file'))
+            # This will throw an exception if your .ini file is not set properly.
+            # The session is shared process wide, refresh_session=True logs in again.
+            self.gbdx_connection = get_session(kwargs.get('config_file'),
+                                               refresh=kwargs.get('refresh_session', False))
 
         # create a logger
         # for now, just log to the console. We'll replace all the 'print' statements 
@@ -8,10 +8,355 @@ GBDX Workflow interface.
 from __future__ import print_function
 from builtins import object
 
+import copy
 import json
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+
+import requests
+from six import string_types
+from gbdx_auth import gbdx_auth
+from requests.adapters import DEFAULT_POOLSIZE, DEFAULT_RETRIES, HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# connection pool sizing for the GBDX session
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 50
+
+# responses worth retrying; POSTs are only retried when refused outright
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+POST_RETRY_STATUSES = frozenset([429, 503])
+
+# default number of requests in flight for the *_many methods
+MAX_WORKERS = 8
+
+# seconds a running workflow status / a task definition is served from cache
+STATUS_TTL = 5
+TASK_TTL = 300
+CACHE_MAXSIZE = 1024
+
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# request bodies up to this many bytes are never worth compressing
+GZIP_MIN_SIZE = 1024
+
+# workflow api endpoints, formatted with a workflow, batch workflow or task id
+BASE_URL = 'https://geobigdata.io/workflows/v1'
+WORKFLOWS_URL = BASE_URL + '/workflows'
+WORKFLOW_URL = WORKFLOWS_URL + '/{0}'
+WORKFLOW_EVENTS_URL = WORKFLOW_URL + '/events'
+WORKFLOW_CANCEL_URL = WORKFLOW_URL + '/cancel'
+TASKS_URL = BASE_URL + '/tasks'
+TASK_URL = TASKS_URL + '/{0}'
+BATCH_WORKFLOWS_URL = BASE_URL + '/batch_workflows'
+BATCH_WORKFLOW_URL = BATCH_WORKFLOWS_URL + '/{0}'
+BATCH_WORKFLOW_CANCEL_URL = BATCH_WORKFLOW_URL + '/cancel'
+
+
+def _floats(obj):
+    """Replace the decimal.Decimal numbers ijson produces with floats."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, dict):
+        return dict((k, _floats(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [_floats(v) for v in obj]
+    return obj
+
+
+def _ijson_items(f, prefix):
+    """ijson.items, returning floats (not Decimals) like the json module does."""
+    try:
+        return ijson.items(f, prefix, use_float=True)
+    except TypeError:
+        # ijson < 3.1 has no use_float
+        return (_floats(item) for item in ijson.items(f, prefix))
+
+
+def _loads(r):
+    """Decode the JSON body of a response, with orjson when available."""
+    if orjson is None:
+        return r.json()
+    return orjson.loads(r.content)
+
+
+def _dumps(obj):
+    """Encode obj as a JSON request body (bytes), with orjson when available.
+
+    Anything orjson refuses is handed to the json module, so the accepted
+    input doesn't depend on whether orjson is installed.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj).encode('utf-8')
+
+
+class _Retry(Retry):
+    """Retry policy that only re-sends a POST if the server refused it.
+
+    GETs are retried on throttling and gateway errors. A POST (launching
+    a workflow, placing an order) is retried only on 429 and 503, where
+    the server turned it away. A 502/504 or a read timeout may come after
+    the server already acted on it. POSTs are not in the retryable
+    methods, so urllib3 never retries them on read errors.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == 'POST':
+            return status_code in POST_RETRY_STATUSES
+        return super(_Retry, self).is_retry(method, status_code, has_retry_after)
+
+
+def _retry():
+    """Retry policy for GBDX requests.
+
+    Failed connections are retried once straight away, throttled (429) and
+    gateway errors with exponential backoff, honoring the Retry-After
+    header. Once retries run out the last response is returned, so callers
+    still see it through raise_for_status().
+    """
+    kwargs = dict(total=5, connect=1, backoff_factor=0.5, status_forcelist=RETRY_STATUSES)
+    try:
+        return _Retry(raise_on_status=False, respect_retry_after_header=True, **kwargs)
+    except TypeError:
+        # older urllib3 (as vendored by older requests) supports fewer options
+        return _Retry(**kwargs)
+
+
+def _gzip(body):
+    """Gzip a request body at the fastest compression level."""
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _has_default_adapter(session):
+    """Whether GBDX requests on session go through the adapter requests mounts by default."""
+    adapter = session.get_adapter(BASE_URL)
+    return (type(adapter) is HTTPAdapter and
+            adapter.max_retries.total == DEFAULT_RETRIES and
+            adapter._pool_connections == DEFAULT_POOLSIZE and
+            adapter._pool_maxsize == DEFAULT_POOLSIZE)
+
+
+def _configure_session(session):
+    """Mount a pooled, retrying HTTPS adapter on a GBDX session.
+
+    Args:
+        session (requests.Session): The session to configure. Anything that
+                                    is not a requests.Session (e.g. a custom
+                                    test connection), or a session whose
+                                    adapter has already been customized, is
+                                    left untouched.
+
+    Returns:
+        Nothing
+    """
+    if not isinstance(session, requests.Session) or not _has_default_adapter(session):
+        return
+
+    session.mount('https://', HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                          pool_maxsize=POOL_MAXSIZE,
+                                          max_retries=_retry()))
+    session.headers['Accept'] = 'application/json'
+
+
+# GBDX sessions shared by every Interface in the process, by config file
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(config_file=None, refresh=False):
+    """Get the process wide GBDX session for a config file.
+
+    The session (and its connection pool) is created on first use and
+    reused afterwards, so re-creating an Interface doesn't reconnect.
+    Custom adapters mounted on it apply to every Interface using it.
+
+    The cached session does not notice changes to the config file or to
+    the GBDX_* environment variables gbdx_auth reads; pass refresh=True
+    (or Interface(refresh_session=True)) to log in again.
+
+    Args:
+        config_file (str): Path to the gbdx config file. Defaults to
+                           the gbdx_auth default (~/.gbdx-config).
+        refresh (bool): Discard the cached session for config_file and
+                        create a new one (default False).
+
+    Returns:
+        A pooled, authenticated requests.Session.
+    """
+    with _SESSIONS_LOCK:
+        session = None if refresh else _SESSIONS.get(config_file)
+        if session is None:
+            session = gbdx_auth.get_session(config_file)
+            _configure_session(session)
+            _SESSIONS[config_file] = session
+        return session
+
+
+# aop_to_s3 workflow, serialized once; Workflow.launch_aop_to_s3 swaps the
+# quoted "__<input>__" placeholders for the JSON encoded input values
+_AOP_TO_S3_INPUTS = ('data', 'bands', 'enable_acomp', 'enable_dra', 'ortho_epsg', 'enable_pansharpen')
+_AOP_TO_S3_TEMPLATE = {
+    "name": "aop_to_s3",
+    "tasks": [{
+        "name": "AOP",
+        "taskType": "AOP_Strip_Processor",
+        "inputs": [{"name": name, "value": "__%s__" % name} for name in _AOP_TO_S3_INPUTS],
+        "outputs": [{"name": "data"}, {"name": "log"}],
+        "timeout": 36000,
+        "containerDescriptors": [{"properties": {"domain": "raid"}}]
+    }, {
+        "name": "StageToS3",
+        "taskType": "StageDataToS3",
+        "inputs": [{"name": "data", "source": "AOP:data"},
+                   {"name": "destination", "value": "__destination__"}],
+        "containerDescriptors": [{"properties": {"domain": "raid"}}]
+    }]
+}
+_AOP_TO_S3_BODY = _dumps(_AOP_TO_S3_TEMPLATE)
+
+
+def _validate_batch_workflow(batch_workflow):
+    """Check a batch workflow for structural mistakes before it is sent to GBDX.
+
+    Args:
+        batch_workflow (dict): Dictionary specifying batch workflow tasks.
+
+    Raises:
+        ValueError: If the batch workflow is malformed, e.g. a task input
+                    refers to a batch value that is not defined.
+    """
+    tasks = batch_workflow.get('tasks')
+    if not isinstance(tasks, list) or not tasks:
+        raise ValueError('Batch workflow has no tasks.')
+    for task in tasks:
+        if not isinstance(task, dict) or not task.get('name') or not task.get('taskType'):
+            raise ValueError('Every task needs a name and a taskType, got: %s' % task)
+
+    batch_values = batch_workflow.get('batch_values')
+    if not isinstance(batch_values, list) or not batch_values:
+        raise ValueError('Batch workflow has no batch_values.')
+    batch_value_names = set()
+    for batch_value in batch_values:
+        if (not isinstance(batch_value, dict) or not batch_value.get('name') or
+                not isinstance(batch_value.get('values'), list)):
+            raise ValueError('Every batch value needs a name and a list of values, got: %s' % batch_value)
+        batch_value_names.add(batch_value['name'])
+
+    for task in tasks:
+        for task_input in task.get('inputs', []):
+            value = task_input.get('value')
+            if isinstance(value, string_types) and value.startswith('$batch_value:'):
+                if value[len('$batch_value:'):] not in batch_value_names:
+                    raise ValueError('Input %s of task %s refers to undefined batch value %s.'
+                                     % (task_input.get('name'), task['name'], value))
+
+
+def _is_terminal(state):
+    """Whether a workflow state (as returned by Workflow.status) can no longer change."""
+    return state.get('state') == 'complete'
+
+
+class _TTLCache(object):
+    """Thread-safe LRU cache whose entries go stale after ttl seconds
+    (never, if ttl is None).
+
+    Stale entries are kept (until evicted) together with the ETag they were
+    served with, so they can be revalidated cheaply.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the (value, etag, expires) entry for key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, value, etag=None):
+        with self._lock:
+            self._entries.pop(key, None)
+            expires = float('inf') if self.ttl is None else time.time() + self.ttl
+            self._entries[key] = (value, etag, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+
+class LaunchError(Exception):
+    """Some of the workflows passed to Workflow.launch_many failed to launch.
+
+    Attributes:
+        workflow_ids (list): Workflow id (str) per workflow, in launch order,
+                             None for the workflows that failed to launch.
+        errors (list): Exception per workflow that failed to launch, None for
+                       the workflows that launched.
+    """
+
+    def __init__(self, message, workflow_ids, errors):
+        super(LaunchError, self).__init__(message)
+        self.workflow_ids = workflow_ids
+        self.errors = errors
+
+
+class WaitTimeout(Exception):
+    """A workflow didn't complete within the time Workflow.run_and_wait allowed.
+
+    Attributes:
+        workflow_id (str): Id of the workflow, which is still running.
+        state (dict): Its last known status.
+    """
+
+    def __init__(self, message, workflow_id, state):
+        super(WaitTimeout, self).__init__(message)
+        self.workflow_id = workflow_id
+        self.state = state
+
+
+class _Flight(object):
+    """A call in progress whose outcome other threads can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.succeeded = False
+        self.result = None
+        self.error = None
 
 
 class Workflow(object):
+    # gzip large request bodies (e.g. big batch workflows), off by default
+    # as not every GBDX endpoint accepts Content-Encoding: gzip
+    compress_requests = False
+
     def __init__(self, interface):
         """Construct the Workflow instance
         
@@ -22,7 +367,12 @@ class Workflow(object):
             An instance of the Workflow class.
         """
         # store a reference to the GBDX Connection
-        self.gbdx_connection = interface.gbdx_connection
+        self.gbdx_connection = interface.gbdx_connection or get_session()
+
+        # keep connections alive across calls so polling doesn't pay a
+        # TCP/TLS handshake per request; a no-op for sessions that already
+        # carry a pooled (or any custom) adapter, e.g. from get_session()
+        _configure_session(self.gbdx_connection)
 
         # store a ref to the s3 interface
         self.s3 = interface.s3
@@ -30,6 +380,17 @@ class Workflow(object):
         # the logger
         self.logger = interface.logger
 
+        # response caches: statuses of running workflows go stale quickly,
+        # finished workflows never change and task definitions rarely do.
+        # Callers always get copies, so they cannot modify cached responses.
+        self._status_cache = _TTLCache(CACHE_MAXSIZE, STATUS_TTL)
+        self._terminal_status = _TTLCache(CACHE_MAXSIZE, None)
+        self._task_cache = _TTLCache(CACHE_MAXSIZE, TASK_TTL)
+
+        # requests in progress, by key, that other threads can wait on
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
     def launch(self, workflow):
         """Launches GBDX workflow.
 
@@ -40,20 +401,78 @@ class Workflow(object):
             Workflow id (str).
         """
 
-        # hit workflow api
-        url = 'https://geobigdata.io/workflows/v1/workflows'
-        try:
-            r = self.gbdx_connection.post(url, json=workflow)
-            try:
-                r.raise_for_status()
-            except:
-                print("GBDX API Status Code: %s" % r.status_code)
-                print("GBDX API Response: %s" % r.text)
-                r.raise_for_status()
-            workflow_id = r.json()['id']
-            return workflow_id
-        except TypeError:
-            self.logger.debug('Workflow not launched!')
+        return self._post_workflow(_dumps(workflow))
+
+    def run_and_wait(self, workflow, initial_interval=1, max_interval=60, factor=1.5, timeout=None):
+        """Launches GBDX workflow and waits for it to complete.
+
+        The status is polled right after the launch and then with exponential
+        backoff: the wait between polls grows by factor up to max_interval,
+        and drops back to initial_interval whenever the workflow changes state.
+
+        Args:
+            workflow (dict): Dictionary specifying workflow tasks.
+            initial_interval (float): Seconds to wait between the first two
+                                      polls, and after each state change.
+            max_interval (float): Longest wait between two polls, in seconds.
+            factor (float): Growth of the wait after each unchanged poll.
+            timeout (float): Seconds to wait for the workflow to complete
+                             before giving up (default None, wait forever).
+
+        Returns:
+            Tuple of the workflow id (str) and its final status (dict).
+
+        Raises:
+            WaitTimeout: If the workflow didn't complete within timeout. The
+                         workflow keeps running.
+        """
+        workflow_id = self.launch(workflow)
+        deadline = None if timeout is None else time.time() + timeout
+
+        interval = initial_interval
+        state = self.status(workflow_id)
+        while not _is_terminal(state):
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise WaitTimeout('Workflow %s did not complete within %s seconds, last status: %s'
+                                      % (workflow_id, timeout, state), workflow_id, state)
+                interval = min(interval, remaining)
+
+            time.sleep(interval)
+            previous_state, state = state, self.status(workflow_id)
+            if state != previous_state:
+                interval = initial_interval
+            else:
+                interval = min(interval * factor, max_interval)
+
+        return workflow_id, state
+
+    def launch_many(self, workflows, max_workers=MAX_WORKERS):
+        """Launches several GBDX workflows concurrently.
+
+        Args:
+            workflows (list): List of dictionaries specifying workflow tasks.
+            max_workers (int): Maximum number of launches in flight at once.
+
+        Returns:
+            List of workflow ids (str), in the same order as workflows.
+
+        Raises:
+            LaunchError: If any of the workflows failed to launch. The ids of
+                         the ones that did launch are on the exception.
+        """
+        workflow_ids, errors = self._map_concurrently(self.launch, workflows, max_workers)
+        failures = [e for e in errors if e is not None]
+        if failures:
+            launched = [i for i in workflow_ids if i is not None]
+            self.logger.error('%s of %s workflows failed to launch, launched workflows: %s',
+                              len(failures), len(errors), launched)
+            raise LaunchError('%s of %s workflows failed to launch, first error: %s'
+                              % (len(failures), len(errors), failures[0]),
+                              workflow_ids, errors)
+
+        return workflow_ids
 
     def status(self, workflow_id):
         """Checks workflow status.
@@ -62,13 +481,61 @@ class Workflow(object):
              workflow_id (str): Workflow id.
 
          Returns:
-             Workflow status (str).
+             Workflow status (dict).
         """
+        entry = self._terminal_status.get(workflow_id)
+        if entry is not None:
+            return copy.deepcopy(entry[0])
+
+        # concurrent callers polling the same workflow share one request
+        state = self._single_flight(workflow_id, self._fetch_status, workflow_id)
+        return copy.deepcopy(state)
+
+    def _fetch_status(self, workflow_id):
+        """Gets workflow status from the status cache or the GBDX API."""
         self.logger.debug('Get status of workflow: ' + workflow_id)
-        url = 'https://geobigdata.io/workflows/v1/workflows/' + workflow_id
-        r = self.gbdx_connection.get(url)
+        url = WORKFLOW_URL.format(workflow_id)
+        state = self._cached_get(self._status_cache, url)['state']
+
+        if _is_terminal(state):
+            self._terminal_status.set(workflow_id, state)
+            self._status_cache.pop(url)
+
+        return state
+
+    def invalidate(self, workflow_id):
+        """Drops any cached status of a workflow or batch workflow.
+
+         Args:
+             workflow_id (str): Workflow id or batch workflow id.
+
+         Returns:
+             Nothing
+        """
+        self._terminal_status.pop(workflow_id)
+        self._status_cache.pop(WORKFLOW_URL.format(workflow_id))
+        self._status_cache.pop(BATCH_WORKFLOW_URL.format(workflow_id))
+
+    def status_many(self, workflow_ids, max_workers=MAX_WORKERS):
+        """Checks the status of several workflows concurrently.
+
+         Duplicate ids are only requested once, with up to max_workers
+         requests in flight at once on the shared session.
+
+         Args:
+             workflow_ids (list): List of workflow ids (str).
+             max_workers (int): Maximum number of requests in flight at once.
+
+         Returns:
+             Dictionary mapping each workflow id to its status.
+        """
+        unique_ids = list(OrderedDict.fromkeys(workflow_ids))
+        statuses, errors = self._map_concurrently(self.status, unique_ids, max_workers)
+        for error in errors:
+            if error is not None:
+                raise error
 
-        return r.json()['state']
+        return dict(zip(unique_ids, statuses))
 
     def events(self, workflow_id):
         '''Get workflow events.
@@ -79,11 +546,36 @@ class Workflow(object):
          Returns:
              List of workflow events.
         '''
-        self.logger.debug('Get events of workflow: ' + workflow_id)
-        url = 'https://geobigdata.io/workflows/v1/workflows/' + workflow_id + '/events'
-        r = self.gbdx_connection.get(url)
+        return list(self.iter_events(workflow_id))
+
+    def iter_events(self, workflow_id):
+        '''Iterate over workflow events as they are read from the response.
+
+         If ijson is installed the response is parsed incrementally, so long
+         event lists are never held in memory as a whole.
+
+         Args:
+             workflow_id (str): Workflow id.
 
-        return r.json()['Events']
+         Returns:
+             Generator of workflow events.
+        '''
+        self.logger.debug('Get events of workflow: ' + workflow_id)
+        url = WORKFLOW_EVENTS_URL.format(workflow_id)
+        r = self.gbdx_connection.get(url, stream=True)
+        try:
+            r.raise_for_status()
+            if ijson is None:
+                events = _loads(r)['Events']
+            else:
+                # let urllib3 undo any gzip transfer encoding
+                r.raw.decode_content = True
+                events = _ijson_items(r.raw, 'Events.item')
+
+            for event in events:
+                yield event
+        finally:
+            r.close()
 
     def cancel(self, workflow_id):
         """Cancels a running workflow.
@@ -95,9 +587,10 @@ class Workflow(object):
                Nothing
         """
         self.logger.debug('Canceling workflow: ' + workflow_id)
-        url = 'https://geobigdata.io/workflows/v1/workflows/' + workflow_id + '/cancel'
+        url = WORKFLOW_CANCEL_URL.format(workflow_id)
         r = self.gbdx_connection.post(url, data='')
         r.raise_for_status()
+        self.invalidate(workflow_id)
 
     def list_tasks(self):
         """Get a list of all the workflow task definitions I'm allowed to see
@@ -109,10 +602,8 @@ class Workflow(object):
                 Task list (list)
 
         """
-        url = 'https://geobigdata.io/workflows/v1/tasks'
-        r = self.gbdx_connection.get(url)
-        r.raise_for_status()
-        return r.json()
+        url = TASKS_URL
+        return copy.deepcopy(self._cached_get(self._task_cache, url))
 
     def describe_task(self, task_name):
         """Get the task definition.
@@ -124,11 +615,8 @@ class Workflow(object):
              Task definition (dict).
         """
 
-        url = 'https://geobigdata.io/workflows/v1/tasks/' + task_name
-        r = self.gbdx_connection.get(url)
-        r.raise_for_status()
-
-        return r.json()
+        url = TASK_URL.format(task_name)
+        return copy.deepcopy(self._cached_get(self._task_cache, url))
 
     def launch_batch_workflow(self, batch_workflow):
         """Launches GBDX batch workflow.
@@ -138,16 +626,19 @@ class Workflow(object):
 
         Returns:
             Batch Workflow id (str).
+
+        Raises:
+            ValueError: If the batch workflow is malformed.
         """
 
+        _validate_batch_workflow(batch_workflow)
+
         # hit workflow api
-        url = 'https://geobigdata.io/workflows/v1/batch_workflows'
-        try:
-            r = self.gbdx_connection.post(url, json=batch_workflow)
-            batch_workflow_id = r.json()['batch_workflow_id']
-            return batch_workflow_id
-        except TypeError as e:
-            self.logger.debug('Batch Workflow not launched, reason: {0}'.format(e.message))
+        url = BATCH_WORKFLOWS_URL
+        r = self._post_json(url, _dumps(batch_workflow))
+        self._raise_for_status(r)
+        batch_workflow_id = _loads(r)['batch_workflow_id']
+        return batch_workflow_id
 
     def batch_workflow_status(self, batch_workflow_id):
         """Checks GBDX batch workflow status.
@@ -159,25 +650,30 @@ class Workflow(object):
              Batch Workflow status (str).
         """
         self.logger.debug('Get status of batch workflow: ' + batch_workflow_id)
-        url = 'https://geobigdata.io/workflows/v1/batch_workflows/' + batch_workflow_id
-        r = self.gbdx_connection.get(url)
+        url = BATCH_WORKFLOW_URL.format(batch_workflow_id)
+        return copy.deepcopy(self._cached_get(self._status_cache, url))
 
-        return r.json()
-
-    def batch_workflow_cancel(self, batch_workflow_id):
+    def batch_workflow_cancel(self, batch_workflow_id, return_body=False):
         """Cancels GBDX batch workflow.
 
          Args:
              batch workflow_id (str): Batch workflow id.
+             return_body (bool): Decode and return the batch workflow status
+                                 sent back by the server (default False).
 
          Returns:
-             Batch Workflow status (str).
+             Batch Workflow status (dict) if return_body, otherwise Nothing.
         """
         self.logger.debug('Cancel batch workflow: ' + batch_workflow_id)
-        url = 'https://geobigdata.io/workflows/v1/batch_workflows/{0}/cancel'.format(batch_workflow_id)
+        url = BATCH_WORKFLOW_CANCEL_URL.format(batch_workflow_id)
         r = self.gbdx_connection.post(url)
-
-        return r.json()
+        self.invalidate(batch_workflow_id)
+        try:
+            r.raise_for_status()
+            if return_body:
+                return _loads(r)
+        finally:
+            r.close()
 
     def launch_aop_to_s3(self,
                          input_location,
@@ -210,70 +706,181 @@ class Workflow(object):
                Workflow id (str).
         """
 
-        # create workflow dictionary
-        aop_to_s3 = json.loads("""{
-        "tasks": [{
-        "containerDescriptors": [{
-            "properties": {"domain": "raid"}}],
-        "name": "AOP",
-        "inputs": [{
-            "name": "data",
-            "value": "INPUT_BUCKET"
-        }, {
-            "name": "bands",
-            "value": "Auto"
-        },
-           {
-            "name": "enable_acomp",
-            "value": "false"
-        }, {
-            "name": "enable_dra",
-            "value": "false"
-        }, {
-            "name": "ortho_epsg",
-            "value": "EPSG:4326"
-        }, {
-            "name": "enable_pansharpen",
-            "value": "false"
-        }],
-        "outputs": [{
-            "name": "data"
-        }, {
-            "name": "log"
-        }],
-        "timeout": 36000,
-        "taskType": "AOP_Strip_Processor",
-        "containerDescriptors": [{"properties": {"domain": "raid"}}]
-        }, {
-        "inputs": [{
-            "source": "AOP:data",
-            "name": "data"
-        }, {
-            "name": "destination",
-            "value": "OUTPUT_BUCKET"
-        }],
-        "name": "StageToS3",
-        "taskType": "StageDataToS3",
-        "containerDescriptors": [{"properties": {"domain": "raid"}}]
-        }],
-        "name": "aop_to_s3"
-        }""")
-
-        aop_to_s3['tasks'][0]['inputs'][0]['value'] = input_location
-        aop_to_s3['tasks'][0]['inputs'][1]['value'] = bands
-        aop_to_s3['tasks'][0]['inputs'][2]['value'] = enable_acomp
-        aop_to_s3['tasks'][0]['inputs'][3]['value'] = enable_dra
-        aop_to_s3['tasks'][0]['inputs'][4]['value'] = ortho_epsg
-        aop_to_s3['tasks'][0]['inputs'][5]['value'] = enable_pansharpen
-
         # use the user bucket and prefix information to set output location
         bucket = self.s3.info['bucket']
         prefix = self.s3.info['prefix']
         output_location_final = 's3://' + '/'.join([bucket, prefix, output_location])
-        aop_to_s3['tasks'][1]['inputs'][1]['value'] = output_location_final
+
+        # fill the input values into the serialized workflow
+        aop_inputs = {'data': input_location,
+                      'bands': bands,
+                      'enable_acomp': enable_acomp,
+                      'enable_dra': enable_dra,
+                      'ortho_epsg': ortho_epsg,
+                      'enable_pansharpen': enable_pansharpen,
+                      'destination': output_location_final}
+        body = _AOP_TO_S3_BODY
+        for name, value in aop_inputs.items():
+            body = body.replace(_dumps('__%s__' % name), _dumps(value))
 
         # launch workflow
         self.logger.debug('Launch workflow')
-        workflow_id = self.launch(aop_to_s3)
+        workflow_id = self._post_workflow(body)
+
+        return workflow_id
+
+    def _post_workflow(self, body):
+        """Launches a workflow that is already serialized to JSON.
+
+        Args:
+            body (bytes): JSON encoded workflow.
+
+        Returns:
+            Workflow id (str).
+        """
 
+        # hit workflow api
+        url = WORKFLOWS_URL
+        r = self._post_json(url, body)
+        self._raise_for_status(r)
+        workflow_id = _loads(r)['id']
         return workflow_id
+
+    def _raise_for_status(self, r):
+        """Logs and raises the error of a failed response.
+
+        Args:
+            r (requests.Response): The response to check.
+
+        Raises:
+            requests.HTTPError: If the request failed.
+        """
+        # only decode the response body if the error will actually be logged
+        if not r.ok and self.logger.isEnabledFor(logging.ERROR):
+            self.logger.error('GBDX API Status Code: %s, Response: %s', r.status_code, r.text)
+        r.raise_for_status()
+
+    def _post_json(self, url, body):
+        """POST a JSON encoded body, gzipped if compress_requests is set.
+
+        Args:
+            url (str): Url to post to.
+            body (bytes): JSON encoded request body.
+
+        Returns:
+            The response.
+        """
+        headers = JSON_HEADERS
+        if self.compress_requests and len(body) > GZIP_MIN_SIZE:
+            body = _gzip(body)
+            headers = dict(JSON_HEADERS)
+            headers['Content-Encoding'] = 'gzip'
+
+        return self.gbdx_connection.post(url, data=body, headers=headers)
+
+    def _cached_get(self, cache, url):
+        """GET a JSON document, serving it from cache while fresh.
+
+        Once an entry goes stale it is revalidated with If-None-Match if the
+        server sent an ETag, so an unchanged document costs a 304 only.
+
+        Args:
+            cache (_TTLCache): Cache to read from and store into.
+            url (str): Document url, also used as the cache key.
+
+        Returns:
+            The decoded JSON document.
+        """
+        entry = cache.get(url)
+        if entry is not None and entry[2] > time.time():
+            return entry[0]
+
+        headers = {}
+        if entry is not None and entry[1]:
+            headers['If-None-Match'] = entry[1]
+
+        r = self.gbdx_connection.get(url, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            value = entry[0]
+            etag = r.headers.get('ETag', entry[1])
+        else:
+            r.raise_for_status()
+            value = _loads(r)
+            etag = r.headers.get('ETag')
+
+        cache.set(url, value, etag)
+        return value
+
+    def _single_flight(self, key, func, *args):
+        """Calls func(*args) unless a call for the same key is already in
+        progress, in which case that call's outcome is shared.
+
+        Args:
+            key: Identifies calls that are interchangeable.
+            func (callable): The call to make.
+
+        Returns:
+            The result of func.
+        """
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.succeeded:
+                return flight.result
+            if flight.error is not None:
+                raise flight.error
+            # the leading call was aborted by something other than an Exception
+            # (KeyboardInterrupt, SystemExit, ...) and has no outcome to share
+            raise RuntimeError('Call for %s was interrupted in another thread' % (key,))
+
+        try:
+            flight.result = func(*args)
+            flight.succeeded = True
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def _map_concurrently(self, func, items, max_workers):
+        """Apply func to every item on a pool of threads sharing this session.
+
+        Args:
+            func (callable): Function of one argument issuing a GBDX request.
+            items (list): Arguments to call func with.
+            max_workers (int): Maximum number of threads, capped at POOL_MAXSIZE.
+
+        Returns:
+            Tuple of two lists in the same order as items: the results (None
+            where the call failed) and the exceptions raised (None where the
+            call succeeded).
+        """
+        items = list(items)
+        if not items:
+            return [], []
+
+        # never run more threads than the session keeps pooled connections,
+        # otherwise surplus connections are opened and thrown away per call
+        pool = ThreadPool(min(max_workers, POOL_MAXSIZE, len(items)))
+        try:
+            calls = [pool.apply_async(func, (item,)) for item in items]
+            results, errors = [], []
+            for call in calls:
+                try:
+                    results.append(call.get())
+                    errors.append(None)
+                except Exception as e:
+                    results.append(None)
+                    errors.append(e)
+            return results, errors
+        finally:
+            pool.close()
+            pool.join()
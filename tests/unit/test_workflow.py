@@ -6,12 +6,20 @@ Unit test the workflow class
 """
 
 from gbdxtools import Interface
-from gbdxtools.workflow import Workflow
+from gbdxtools import workflow as workflow_module
+from gbdxtools.workflow import Workflow, LaunchError, WaitTimeout
 from auth_mock import get_mock_gbdx_session
+from requests import HTTPError
+from requests.adapters import HTTPAdapter
 import vcr
 import unittest
+import io
+from decimal import Decimal
 import os
+import gzip
 import json
+import threading
+import time
 
 """
 How to use the mock_gbdx_session and vcr to create unit tests:
@@ -26,6 +34,57 @@ How to use the mock_gbdx_session and vcr to create unit tests:
 """
 
 
+class FakeResponse(object):
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+        self.raw = io.BytesIO(self.content)
+
+    def close(self):
+        self.closed = True
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return json.dumps(self.body)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError('%s Error' % self.status_code, response=self)
+
+    @property
+    def content(self):
+        return json.dumps(self.body).encode('utf-8')
+
+    def json(self):
+        return self.body
+
+
+class FakeConnection(object):
+    """Records requests and answers them from a list of canned responses."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(('GET', url, kwargs))
+        return self.responses.pop(0)
+
+    def post(self, url, **kwargs):
+        self.requests.append(('POST', url, kwargs))
+        return self.responses.pop(0)
+
+
+class FakeS3(object):
+    info = {'bucket': 'gbd-customer-data', 'prefix': 'some-prefix'}
+
+
 class WorkflowTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -48,6 +107,40 @@ class WorkflowTests(unittest.TestCase):
         self.assertTrue(wf.s3 is not None)
         self.assertTrue(wf.gbdx_connection is not None)
 
+    def test_init_mounts_pooled_adapter(self):
+        wf = Workflow(self.gbdx)
+        adapter = wf.gbdx_connection.get_adapter('https://geobigdata.io/workflows/v1/tasks')
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertTrue(429 in adapter.max_retries.status_forcelist)
+        self.assertEqual(wf.gbdx_connection.headers['Accept'], 'application/json')
+
+    def test_retry_policy(self):
+        retry = workflow_module._retry()
+        self.assertEqual(retry.connect, 1)
+
+        # idempotent requests are retried on throttling and gateway errors
+        for status_code in (429, 502, 503, 504):
+            self.assertTrue(retry.is_retry('GET', status_code))
+        self.assertFalse(retry.is_retry('GET', 500))
+
+        # a POST is only re-sent if the server refused it
+        self.assertTrue(retry.is_retry('POST', 429))
+        self.assertTrue(retry.is_retry('POST', 503))
+        self.assertFalse(retry.is_retry('POST', 502))
+        self.assertFalse(retry.is_retry('POST', 504))
+        self.assertFalse(retry._is_method_retryable('POST'))
+
+        # the policy survives urllib3 copying it between attempts
+        self.assertFalse(retry.increment('GET', 'https://geobigdata.io', error=None).is_retry('POST', 502))
+
+    def test_init_keeps_custom_adapter(self):
+        session = get_mock_gbdx_session(token="dummytoken")
+        adapter = HTTPAdapter(max_retries=2)
+        session.mount('https://', adapter)
+        gbdx = Interface(gbdx_connection=session)
+        self.assertTrue(gbdx.workflow.gbdx_connection.get_adapter(workflow_module.BASE_URL) is adapter)
+        self.assertTrue('application/json' not in session.headers['Accept'])
+
     @vcr.use_cassette('tests/unit/cassettes/test_list_tasks.yaml', filter_headers=['authorization'])
     def test_list_tasks(self):
         wf = Workflow(self.gbdx)
@@ -83,7 +176,7 @@ class WorkflowTests(unittest.TestCase):
         self.assertEqual(batch_workflow_id, batch_workflow_status.get("batch_workflow_id"))
 
         # test cancel
-        batch_workflow_status = wf.batch_workflow_cancel(batch_workflow_id)
+        batch_workflow_status = wf.batch_workflow_cancel(batch_workflow_id, return_body=True)
 
         workflows = batch_workflow_status.get('workflows')
 
@@ -107,3 +200,387 @@ class WorkflowTests(unittest.TestCase):
             assert event['state'] in ['pending','running','complete']
             assert event['event'] in ['submitted','scheduled','rescheduling','started','succeeded','failed','timedout']
 
+
+    def test_launch_many_preserves_order(self):
+        wf = Workflow(self.gbdx)
+        wf.launch = lambda workflow: workflow['name'] + '_id'
+        workflows = [{'name': 'wf%d' % i} for i in range(20)]
+        ids = wf.launch_many(workflows, max_workers=4)
+        self.assertEqual(ids, ['wf%d_id' % i for i in range(20)])
+        self.assertEqual(wf.launch_many([]), [])
+
+    def test_launch_many_reports_launched_ids_on_failure(self):
+        wf = Workflow(self.gbdx)
+
+        def launch(workflow):
+            if workflow['name'] == 'wf2':
+                raise HTTPError('500 Error')
+            return workflow['name'] + '_id'
+
+        wf.launch = launch
+        workflows = [{'name': 'wf%d' % i} for i in range(5)]
+        try:
+            wf.launch_many(workflows)
+            self.fail('LaunchError not raised')
+        except LaunchError as e:
+            self.assertEqual(e.workflow_ids, ['wf0_id', 'wf1_id', None, 'wf3_id', 'wf4_id'])
+            self.assertTrue(isinstance(e.errors[2], HTTPError))
+            self.assertEqual([error for error in e.errors if error is not None], [e.errors[2]])
+
+    def test_status_many(self):
+        wf = Workflow(self.gbdx)
+        wf.status = lambda workflow_id: {'state': 'running', 'id': workflow_id}
+        statuses = wf.status_many(['1', '2', '3'])
+        self.assertEqual(sorted(statuses.keys()), ['1', '2', '3'])
+        self.assertEqual(statuses['2']['id'], '2')
+
+    def test_status_many_polls_each_id_once(self):
+        wf = Workflow(self.gbdx)
+        polled = []
+        wf.status = lambda workflow_id: polled.append(workflow_id) or {'state': 'running'}
+        ids = [str(i % 7) for i in range(30)]
+        statuses = wf.status_many(ids, max_workers=3)
+        self.assertEqual(sorted(polled), sorted(set(ids)))
+        self.assertEqual(len(statuses), 7)
+
+    @vcr.use_cassette('tests/unit/cassettes/test_workflow_events.yaml', filter_headers=['authorization'])
+    def test_iter_events_without_ijson(self):
+        wf = Workflow(self.gbdx)
+        ijson = workflow_module.ijson
+        workflow_module.ijson = None
+        try:
+            events = wf.iter_events('4347109104758907277')
+            first = next(events)
+            self.assertTrue('state' in first)
+            self.assertTrue(len(list(events)) > 0)
+        finally:
+            workflow_module.ijson = ijson
+
+    def test_iter_events_types_do_not_depend_on_ijson(self):
+        body = {'Events': [{'task': 'AOP', 'state': 'running', 'event': 'started',
+                            'progress': 0.25, 'attempt': 2, 'when': None}]}
+
+        def events():
+            wf = Workflow(self.gbdx)
+            wf.gbdx_connection = FakeConnection([FakeResponse(body)])
+            return wf.events('123')
+
+        streamed = events()
+        ijson = workflow_module.ijson
+        workflow_module.ijson = None
+        try:
+            buffered = events()
+        finally:
+            workflow_module.ijson = ijson
+
+        self.assertEqual(streamed, body['Events'])
+        self.assertEqual(streamed, buffered)
+        self.assertEqual([type(v) for v in streamed[0].values()], [type(v) for v in buffered[0].values()])
+        json.dumps(streamed)
+
+        # ijson < 3.1 yields Decimals, which are converted after parsing
+        converted = workflow_module._floats({'Events': [{'progress': Decimal('0.25')}]})
+        self.assertTrue(isinstance(converted['Events'][0]['progress'], float))
+
+    def test_status_is_cached_until_stale(self):
+        wf = Workflow(self.gbdx)
+        running = {'state': {'state': 'running', 'event': 'started'}}
+        wf.gbdx_connection = FakeConnection([FakeResponse(running, headers={'ETag': '"v1"'}),
+                                             FakeResponse(None, status_code=304)])
+        self.assertEqual(wf.status('123'), running['state'])
+        self.assertEqual(wf.status('123'), running['state'])
+        self.assertEqual(len(wf.gbdx_connection.requests), 1)
+
+        # once stale, the cached status is revalidated with its ETag
+        url = wf.gbdx_connection.requests[0][1]
+        wf._status_cache.ttl = 0
+        wf._status_cache.set(url, running, '"v1"')
+        self.assertEqual(wf.status('123'), running['state'])
+        self.assertEqual(wf.gbdx_connection.requests[1][2]['headers'], {'If-None-Match': '"v1"'})
+
+    def test_terminal_status_is_never_refetched(self):
+        wf = Workflow(self.gbdx)
+        wf._status_cache.ttl = 0
+        done = {'state': {'state': 'complete', 'event': 'succeeded'}}
+        wf.gbdx_connection = FakeConnection([FakeResponse(done), FakeResponse(done)])
+        self.assertEqual(wf.status('123'), done['state'])
+        self.assertEqual(wf.status('123'), done['state'])
+        self.assertEqual(len(wf.gbdx_connection.requests), 1)
+
+        wf.invalidate('123')
+        wf.status('123')
+        self.assertEqual(len(wf.gbdx_connection.requests), 2)
+
+    def test_terminal_status_cache_is_bounded(self):
+        wf = Workflow(self.gbdx)
+        wf._terminal_status.maxsize = 2
+        done = {'state': {'state': 'complete', 'event': 'succeeded'}}
+        wf.gbdx_connection = FakeConnection([FakeResponse(done) for _ in range(4)])
+        for workflow_id in ('1', '2', '3', '1'):
+            wf.status(workflow_id)
+        # '1' was evicted by '3' and had to be fetched again
+        self.assertEqual(len(wf.gbdx_connection.requests), 4)
+
+    def test_cached_responses_are_copies(self):
+        wf = Workflow(self.gbdx)
+        done = {'state': {'state': 'complete', 'event': 'succeeded'}}
+        wf.gbdx_connection = FakeConnection([FakeResponse(done), FakeResponse({'tasks': ['HelloGBDX']})])
+        wf.status('123')['event'] = 'changed'
+        self.assertEqual(wf.status('123')['event'], 'succeeded')
+        wf.list_tasks()['tasks'].append('changed')
+        self.assertEqual(wf.list_tasks(), {'tasks': ['HelloGBDX']})
+
+    def test_task_definitions_are_cached(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([FakeResponse({'tasks': ['HelloGBDX']})])
+        self.assertEqual(wf.list_tasks(), wf.list_tasks())
+        self.assertEqual(len(wf.gbdx_connection.requests), 1)
+        self.assertEqual(wf._task_cache.ttl, workflow_module.TASK_TTL)
+
+    def test_launch_aop_to_s3(self):
+        wf = Workflow(self.gbdx)
+        wf.s3 = FakeS3()
+        launched = []
+        wf._post_workflow = lambda body: launched.append(json.loads(body.decode('utf-8'))) or 'some_id'
+
+        self.assertEqual(wf.launch_aop_to_s3('s3://receiving-dgcs-tdgplatform-com/055093376010_01_003',
+                                             'aop_output', enable_acomp='true'), 'some_id')
+        aop_task, stage_task = launched[0]['tasks']
+        aop_inputs = dict((i['name'], i['value']) for i in aop_task['inputs'])
+        self.assertEqual(aop_inputs['data'], 's3://receiving-dgcs-tdgplatform-com/055093376010_01_003')
+        self.assertEqual(aop_inputs['enable_acomp'], 'true')
+        self.assertEqual(aop_inputs['bands'], 'Auto')
+        self.assertEqual(stage_task['inputs'][1]['value'], 's3://gbd-customer-data/some-prefix/aop_output')
+
+        self.assertEqual(len(aop_task['inputs']), 6)
+
+        # values are JSON encoded, not pasted into the body verbatim
+        wf.launch_aop_to_s3('s3://another/location', 'other "output"')
+        self.assertEqual(launched[1]['tasks'][0]['inputs'][0]['value'], 's3://another/location')
+        self.assertEqual(launched[1]['tasks'][1]['inputs'][1]['value'],
+                         's3://gbd-customer-data/some-prefix/other "output"')
+
+    def test_launch_posts_json_body(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([FakeResponse({'id': '123'})])
+        workflow = {'name': 'test', 'tasks': [{'name': 'hello', 'taskType': 'HelloGBDX'}]}
+        self.assertEqual(wf.launch(workflow), '123')
+        method, url, kwargs = wf.gbdx_connection.requests[0]
+        self.assertEqual(json.loads(kwargs['data'].decode('utf-8')), workflow)
+        self.assertEqual(kwargs['headers']['Content-Type'], 'application/json')
+
+    def test_dumps_accepts_what_json_accepts(self):
+        self.assertEqual(json.loads(workflow_module._dumps({1: 'a'}).decode('utf-8')), {'1': 'a'})
+        self.assertEqual(json.loads(workflow_module._dumps({'big': 2 ** 70}).decode('utf-8')), {'big': 2 ** 70})
+        self.assertRaises(TypeError, workflow_module._dumps, {'not json': object()})
+
+    def test_json_helpers_without_orjson(self):
+        orjson = workflow_module.orjson
+        workflow_module.orjson = None
+        try:
+            body = workflow_module._dumps({'name': 'test'})
+            self.assertTrue(isinstance(body, bytes))
+            self.assertEqual(workflow_module._loads(FakeResponse({'name': 'test'})), {'name': 'test'})
+        finally:
+            workflow_module.orjson = orjson
+
+    def test_launch_failure_raises(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([FakeResponse({'reason': 'bad task'}, status_code=400)])
+        self.assertRaises(HTTPError, wf.launch, {'name': 'test', 'tasks': []})
+
+    def test_launch_batch_workflow_failure_raises(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([FakeResponse({'reason': 'slow down'}, status_code=429)])
+        with open(os.path.join(self.data_path, "batch_workflow.json")) as json_file:
+            batch_workflow = json.loads(json_file.read())
+        self.assertRaises(HTTPError, wf.launch_batch_workflow, batch_workflow)
+
+    def test_get_session_is_shared(self):
+        created = []
+
+        class FakeAuth(object):
+            @staticmethod
+            def get_session(config_file):
+                created.append(config_file)
+                return get_mock_gbdx_session(token="dummytoken")
+
+        gbdx_auth = workflow_module.gbdx_auth
+        workflow_module.gbdx_auth = FakeAuth
+        try:
+            session = workflow_module.get_session('/tmp/gbdx-test-config')
+            self.assertTrue(workflow_module.get_session('/tmp/gbdx-test-config') is session)
+            self.assertEqual(created, ['/tmp/gbdx-test-config'])
+            self.assertEqual(session.headers['Accept'], 'application/json')
+
+            # re-creating the Interface keeps the session's pooled adapter,
+            # and adapters mounted by the user stay in place too
+            adapter = session.get_adapter(workflow_module.BASE_URL)
+            Interface(config_file='/tmp/gbdx-test-config')
+            gbdx = Interface(config_file='/tmp/gbdx-test-config')
+            self.assertTrue(gbdx.gbdx_connection is session)
+            self.assertTrue(session.get_adapter(workflow_module.BASE_URL) is adapter)
+
+            custom_adapter = HTTPAdapter(max_retries=2)
+            session.mount('https://', custom_adapter)
+            Interface(config_file='/tmp/gbdx-test-config')
+            self.assertTrue(session.get_adapter(workflow_module.BASE_URL) is custom_adapter)
+
+            # refreshing logs in again and replaces the shared session
+            refreshed = Interface(config_file='/tmp/gbdx-test-config', refresh_session=True).gbdx_connection
+            self.assertFalse(refreshed is session)
+            self.assertEqual(len(created), 2)
+            self.assertTrue(workflow_module.get_session('/tmp/gbdx-test-config') is refreshed)
+        finally:
+            workflow_module.gbdx_auth = gbdx_auth
+            workflow_module._SESSIONS.pop('/tmp/gbdx-test-config', None)
+
+    def test_batch_workflow_cancel_skips_body(self):
+        wf = Workflow(self.gbdx)
+        response = FakeResponse({'batch_workflow_id': '123', 'workflows': []})
+        wf.gbdx_connection = FakeConnection([response])
+        self.assertTrue(wf.batch_workflow_cancel('123') is None)
+        self.assertTrue(response.closed)
+
+    def test_run_and_wait_backs_off(self):
+        wf = Workflow(self.gbdx)
+        running = {'state': 'running', 'event': 'started'}
+        states = [{'state': 'pending', 'event': 'submitted'}] + [running] * 4 + \
+                 [{'state': 'complete', 'event': 'succeeded'}]
+        wf.launch = lambda workflow: '123'
+        wf.status = lambda workflow_id: states.pop(0)
+
+        sleeps = []
+        sleep = time.sleep
+        time.sleep = sleeps.append
+        try:
+            workflow_id, state = wf.run_and_wait({'name': 'test'}, initial_interval=1, max_interval=3, factor=2)
+        finally:
+            time.sleep = sleep
+
+        self.assertEqual(workflow_id, '123')
+        self.assertEqual(state['event'], 'succeeded')
+        self.assertEqual(sleeps, [1, 1, 2, 3, 3])
+
+    def test_run_and_wait_timeout(self):
+        wf = Workflow(self.gbdx)
+        running = {'state': 'running', 'event': 'started'}
+        wf.launch = lambda workflow: '123'
+        wf.status = lambda workflow_id: running
+
+        clock = [1000.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        real_sleep, real_time = time.sleep, time.time
+        time.sleep, time.time = sleep, lambda: clock[0]
+        try:
+            self.assertRaises(WaitTimeout, wf.run_and_wait, {'name': 'test'},
+                              initial_interval=2, factor=2, timeout=10)
+        finally:
+            time.sleep, time.time = real_sleep, real_time
+
+        # the last wait is cut short so the deadline isn't overshot
+        self.assertEqual(sleeps, [2, 4, 4])
+
+    def test_launch_batch_workflow_validates_before_posting(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([])
+
+        with open(os.path.join(self.data_path, "batch_workflow.json")) as json_file:
+            batch_workflow = json.loads(json_file.read())
+        batch_workflow['tasks'][0]['inputs'][1]['value'] = '$batch_value:input_dme'
+        self.assertRaises(ValueError, wf.launch_batch_workflow, batch_workflow)
+
+        del batch_workflow['batch_values']
+        self.assertRaises(ValueError, wf.launch_batch_workflow, batch_workflow)
+        self.assertRaises(ValueError, wf.launch_batch_workflow, {'name': 'no tasks'})
+        self.assertEqual(wf.gbdx_connection.requests, [])
+
+    def test_compress_requests(self):
+        wf = Workflow(self.gbdx)
+        wf.compress_requests = True
+        wf.gbdx_connection = FakeConnection([FakeResponse({'id': '1'}), FakeResponse({'id': '2'})])
+        small = {'name': 'small', 'tasks': []}
+        large = {'name': 'large', 'tasks': [{'name': 'task%d' % i, 'taskType': 'HelloGBDX'} for i in range(100)]}
+        wf.launch(small)
+        wf.launch(large)
+
+        small_kwargs = wf.gbdx_connection.requests[0][2]
+        self.assertFalse('Content-Encoding' in small_kwargs['headers'])
+        large_kwargs = wf.gbdx_connection.requests[1][2]
+        self.assertEqual(large_kwargs['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.GzipFile(fileobj=io.BytesIO(large_kwargs['data'])).read().decode('utf-8')),
+                         large)
+
+    def test_concurrent_status_calls_share_one_request(self):
+        wf = Workflow(self.gbdx)
+        wf._status_cache.ttl = 0
+        running = {'state': {'state': 'running', 'event': 'started'}}
+        connection = FakeConnection([FakeResponse(running) for _ in range(5)])
+        get = connection.get
+
+        def slow_get(url, **kwargs):
+            time.sleep(0.2)
+            return get(url, **kwargs)
+
+        connection.get = slow_get
+        wf.gbdx_connection = connection
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(wf.status('123'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [running['state']] * 5)
+        self.assertEqual(len(connection.requests), 1)
+        self.assertEqual(wf._inflight, {})
+
+    def test_interrupted_status_call_is_not_shared_as_none(self):
+        wf = Workflow(self.gbdx)
+        started = threading.Event()
+        release = threading.Event()
+
+        def interrupted_fetch(workflow_id):
+            started.set()
+            release.wait()
+            raise KeyboardInterrupt()
+
+        def leader():
+            try:
+                wf._single_flight('123', interrupted_fetch, '123')
+            except KeyboardInterrupt:
+                pass
+
+        outcomes = []
+
+        def follower():
+            try:
+                outcomes.append(wf.status('123'))
+            except RuntimeError as e:
+                outcomes.append(e)
+
+        leader_thread = threading.Thread(target=leader)
+        leader_thread.start()
+        started.wait()
+        follower_thread = threading.Thread(target=follower)
+        follower_thread.start()
+        time.sleep(0.1)
+        release.set()
+        leader_thread.join()
+        follower_thread.join()
+
+        self.assertEqual(len(outcomes), 1)
+        self.assertTrue(isinstance(outcomes[0], RuntimeError))
+        self.assertEqual(wf._inflight, {})
+
+    def test_failed_status_is_not_left_in_flight(self):
+        wf = Workflow(self.gbdx)
+        wf.gbdx_connection = FakeConnection([FakeResponse({}, status_code=500)])
+        self.assertRaises(HTTPError, wf.status, '123')
+        self.assertEqual(wf._inflight, {})